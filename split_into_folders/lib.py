@@ -5,11 +5,22 @@ The function `split()` is a Python port of `split-into-folders.sh` from `ebook-t
 
 Ref.: https://github.com/na--/ebook-tools/blob/master/split-into-folders.sh
 """
+import heapq
 import logging
 import math
+import mmap
 import os
+import random
 import shutil
+import struct
+import sys
+import threading
+import time
 from argparse import Namespace
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 from types import SimpleNamespace
 
@@ -29,6 +40,29 @@ logger.setLevel(logging.CRITICAL + 1)
 DRY_RUN = False
 REVERSE = False
 
+# Index options
+# =============
+# Name of the lookup index file written in the output folder. It is a hidden
+# file so that it gets ignored if the output folder is split again.
+INDEX = False
+INDEX_FILENAME = '.split_index'
+
+# I/O options
+# ===========
+# Limits of the token buckets (None means no limit)
+MAX_IOPS = None
+MAX_BANDWIDTH = None
+# Number of in-flight file operations (None means 1, or ADAPTIVE_MAX_JOBS if
+# adaptive mode is enabled in which case it is the upper bound)
+JOBS = None
+ADAPTIVE = False
+ADAPTIVE_MAX_JOBS = 64
+# In adaptive mode, an operation is considered too slow (i.e. the storage is
+# saturated) if its average latency is greater than its lowest latency seen
+# times this factor. Latencies below ADAPTIVE_MIN_LATENCY are always fine.
+ADAPTIVE_LATENCY_TOLERANCE = 2.0
+ADAPTIVE_MIN_LATENCY = 0.001
+
 # Input/Output options
 # ====================
 # This is the extension of the metadata file associated with an ebook
@@ -110,8 +144,13 @@ def mkdir(path):
         logger.debug(f"Skipping it!")
     else:
         logger.debug(f"Creating folder '{dirname}': {path}")
-        os.mkdir(path)
-        logger.debug("Folder created!")
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            # Created in the meantime by another thread
+            logger.debug(f"Folder already exits: {path}")
+        else:
+            logger.debug("Folder created!")
 
 
 def move(src, dst, clobber=True):
@@ -190,6 +229,535 @@ def setup_log(quiet=False, verbose=False, logging_level=LOGGING_LEVEL,
         logger.debug("Verbose option {}".format("enabled" if verbose else "disabled"))
 
 
+# ============
+# I/O backends
+# ============
+class LocalFS:
+    """File operations on the local (or network mounted) filesystem."""
+
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def getdev(self, path):
+        return os.stat(path).st_dev
+
+    def getsize(self, path):
+        return os.path.getsize(path)
+
+    def list_files(self, folder):
+        for fp in Path(folder).rglob('*'):
+            if Path.is_file(fp):
+                yield fp
+
+    def mkdir(self, path):
+        mkdir(path)
+
+    def move(self, src, dst, clobber=True):
+        move(src, dst, clobber)
+
+
+class FakeFS:
+    """In-memory filesystem that injects latency in every operation.
+
+    Used to test the I/O scheduler locally. `files` maps file paths to their
+    sizes in bytes. Each operation takes `latency` seconds (plus a random
+    `jitter`) as long as there are at most `capacity` operations in flight;
+    beyond that, the latency grows proportionally as with a saturated filer.
+    `devices` maps folders to device numbers (the default device is 0) to
+    simulate moves between filesystems. `seed` and `sleep` can be given to
+    make the latencies reproducible and to not actually wait.
+    """
+
+    def __init__(self, files=None, latency=0.0, jitter=0.0, capacity=None,
+                 devices=None, seed=None, sleep=time.sleep):
+        self.latency = latency
+        self.jitter = jitter
+        self.capacity = capacity
+        self.devices = {Path(folder): device
+                        for folder, device in (devices or {}).items()}
+        self.in_flight = 0
+        self.ops = 0
+        self._random = random.Random(seed)
+        self._sleep = sleep
+        self._files = {}
+        self._dirs = set()
+        self._lock = threading.Lock()
+        for path, size in (files or {}).items():
+            self._add_file(path, size)
+
+    def _add_file(self, path, size):
+        path = Path(path)
+        self._files[str(path)] = size
+        self._dirs.update(str(p) for p in path.parents)
+
+    def _wait(self):
+        with self._lock:
+            self.in_flight += 1
+            self.ops += 1
+            in_flight = self.in_flight
+            delay = self.latency + self._random.uniform(0, self.jitter)
+        if self.capacity and in_flight > self.capacity:
+            delay *= in_flight / self.capacity
+        self._sleep(delay)
+        with self._lock:
+            self.in_flight -= 1
+
+    def exists(self, path):
+        self._wait()
+        path = str(Path(path))
+        return path in self._files or path in self._dirs
+
+    def getdev(self, path):
+        self._wait()
+        path = Path(path)
+        # The device of the closest folder
+        for folder in [path, *path.parents]:
+            if folder in self.devices:
+                return self.devices[folder]
+        return 0
+
+    def getsize(self, path):
+        self._wait()
+        return self._files[str(Path(path))]
+
+    def list_files(self, folder):
+        self._wait()
+        folder = Path(folder)
+        for path in sorted(self._files):
+            if folder in Path(path).parents:
+                yield Path(path)
+
+    def mkdir(self, path):
+        self._wait()
+        with self._lock:
+            self._dirs.add(str(Path(path)))
+
+    def move(self, src, dst, clobber=True):
+        self._wait()
+        src, dst = str(Path(src)), str(Path(dst))
+        with self._lock:
+            if dst in self._files and not clobber:
+                logger.debug(f'{Path(dst).name}: cannot overwrite existing file')
+                return
+            self._add_file(dst, self._files.pop(src))
+
+
+# ==============
+# I/O throttling
+# ==============
+class TokenBucket:
+    """Limit the rate of a resource (e.g. operations or bytes per second).
+
+    Tokens are refilled at `rate` per second up to `capacity` (by default one
+    second worth of tokens). Taking more tokens than available puts the
+    bucket in debt and the caller sleeps until it is paid back, which also
+    handles requests larger than the capacity (e.g. a big file).
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, n=1):
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self._sleep(wait)
+
+
+class IOScheduler:
+    """Run file operations through token buckets and a concurrency limit.
+
+    `max_iops` and `max_bandwidth` (bytes per second) are enforced with token
+    buckets. The bytes of an operation are given by the caller: `split()` only
+    counts the size of the files moved to another filesystem since the other
+    moves are renames. `jobs` is the number of operations allowed to be in
+    flight at once. If `adaptive` is enabled, `jobs` is only the upper bound
+    and the limit is adjusted from the observed latency of each kind of
+    operation (AIMD): it is increased by one after a full window of fast
+    operations and halved as soon as the operations slow down. `clock` and
+    `sleep` can be replaced to test the scheduler without waiting.
+    """
+
+    def __init__(self, max_iops=MAX_IOPS, max_bandwidth=MAX_BANDWIDTH,
+                 jobs=JOBS, adaptive=ADAPTIVE, target_latency=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        if jobs is None:
+            jobs = ADAPTIVE_MAX_JOBS if adaptive else 1
+        self.max_jobs = jobs
+        self.adaptive = adaptive
+        self.target_latency = target_latency
+        self.limit = 1 if adaptive else jobs
+        self.ops = 0
+        self.min_limit = self.max_limit = self.limit
+        self._clock = clock
+        self._iops_bucket = \
+            TokenBucket(max_iops, clock=clock, sleep=sleep) if max_iops else None
+        self._bandwidth_bucket = \
+            TokenBucket(max_bandwidth, clock=clock, sleep=sleep) \
+            if max_bandwidth else None
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        # Adaptive mode: lowest and average latencies for each operation
+        self._min_latency = {}
+        self._avg_latency = {}
+        self._window = 0
+        self._cooldown = 0
+        self._executor = None
+        if self.max_jobs > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+        # Jobs submitted but not finished yet. Their number is bounded so that
+        # the queue doesn't grow with the number of files.
+        self._pending = set()
+        self._slots = threading.Semaphore(4 * self.max_jobs)
+        # First error raised by a job
+        self._error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            # e.g. a job failed or Ctrl-C: don't start the jobs still queued
+            with self._cond:
+                pending = list(self._pending)
+            for future in pending:
+                future.cancel()
+        self.shutdown()
+
+    def call(self, op, *args, nbytes=0, **kwargs):
+        """Call the file operation `op` once a slot and tokens are available."""
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+        try:
+            if self._iops_bucket:
+                self._iops_bucket.acquire()
+            if self._bandwidth_bucket and nbytes:
+                self._bandwidth_bucket.acquire(nbytes)
+            start = self._clock()
+            result = op(*args, **kwargs)
+            latency = self._clock() - start
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
+        with self._cond:
+            self.ops += 1
+            if self.adaptive:
+                self._update_limit(op.__name__, latency)
+        return result
+
+    def submit(self, fn, *args, **kwargs):
+        """Run `fn` in a worker thread (or right away if there is only one
+        job) and return its `Future`.
+
+        Blocks while too many jobs are pending and raises the first error of
+        the previous jobs if any.
+        """
+        if self._executor:
+            self._raise_error()
+            self._slots.acquire()
+            future = self._executor.submit(fn, *args, **kwargs)
+            with self._cond:
+                self._pending.add(future)
+            future.add_done_callback(self._job_done)
+            return future
+        # Run in the calling thread so that an error stops the split right
+        # away (as when there was no scheduler)
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+    def join(self):
+        """Wait for all the submitted jobs and raise the first error if any."""
+        with self._cond:
+            pending = list(self._pending)
+        wait(pending)
+        self._raise_error()
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown()
+
+    def _job_done(self, future):
+        with self._cond:
+            self._pending.discard(future)
+            if not future.cancelled() and future.exception() and \
+                    self._error is None:
+                self._error = future.exception()
+        self._slots.release()
+
+    def _raise_error(self):
+        if self._error:
+            raise self._error
+
+    def _update_limit(self, op_name, latency):
+        min_latency = min(self._min_latency.get(op_name, latency), latency)
+        avg_latency = 0.8 * self._avg_latency.get(op_name, latency) + 0.2 * latency
+        self._min_latency[op_name] = min_latency
+        self._avg_latency[op_name] = avg_latency
+        threshold = self.target_latency or max(
+            ADAPTIVE_LATENCY_TOLERANCE * min_latency, ADAPTIVE_MIN_LATENCY)
+        if self._cooldown:
+            # Wait for the operations started with the old limit to finish
+            self._cooldown -= 1
+        elif avg_latency > threshold:
+            self.limit = max(1, self.limit // 2)
+            self._window = 0
+            self._cooldown = self.limit
+            # Forget the slow latencies so that the new limit is judged on
+            # its own operations
+            self._avg_latency[op_name] = min_latency
+            logger.debug(f"{op_name} too slow ({avg_latency:.4f}s): "
+                         f"decreasing number of in-flight operations to "
+                         f"{self.limit}")
+        else:
+            self._window += 1
+            if self._window >= self.limit and self.limit < self.max_jobs:
+                self.limit += 1
+                self._window = 0
+                self._cond.notify_all()
+        self.min_limit = min(self.min_limit, self.limit)
+        self.max_limit = max(self.max_limit, self.limit)
+
+
+# =====================
+# Lookup index of splits
+# =====================
+# The index is made of segments: `.split_index`, `.split_index.1`,
+# `.split_index.2`, ... Each split adds a segment with its files so that the
+# existing records don't need to be rewritten. The last segments are merged
+# with the new one when they aren't much bigger than it (as with the levels
+# of an LSM tree), which keeps the number of segments logarithmic.
+#
+# Layout of a segment (all integers are little-endian):
+#   - header: magic, number of entries, offset of the offset table and
+#     generation (a merged segment gets a new generation and its records take
+#     precedence over those of older generations)
+#   - records, sorted by file name (encoded with `os.fsencode()`, i.e. the
+#     file name as stored by the filesystem): folder number, width of the
+#     folder name, flags, length of the file name, then the file name itself
+#   - offset table: one uint64 per record giving its position in the file
+# The offset table makes it possible to binary-search the records directly
+# from a memory-mapped file without loading the index into memory.
+_INDEX_MAGIC = b'SPLTIDX2'
+_INDEX_HEADER = struct.Struct('<8sQQQ')
+_INDEX_RECORD = struct.Struct('<QBBH')
+_INDEX_OFFSET = struct.Struct('<Q')
+# Record flags
+_INDEX_HAS_METADATA = 0x01
+# The last segments are merged with the new one if they have at most this
+# many times its number of records
+_INDEX_MERGE_FACTOR = 2
+# All the segments are merged if there are more than this number
+_INDEX_MAX_SEGMENTS = 16
+
+
+def _get_index_path(output_folder, level=0):
+    path = os.path.join(output_folder, INDEX_FILENAME)
+    return f'{path}.{level}' if level else path
+
+
+def _get_index_segments(output_folder):
+    segments = []
+    while os.path.exists(_get_index_path(output_folder, len(segments))):
+        segments.append(_get_index_path(output_folder, len(segments)))
+    return segments
+
+
+def _index_record_at(mm, offset):
+    folder_num, width, flags, name_len = _INDEX_RECORD.unpack_from(mm, offset)
+    start = offset + _INDEX_RECORD.size
+    return mm[start:start+name_len], folder_num, width, flags
+
+
+def _open_index(index_path):
+    with open(index_path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, count, table_offset, generation = _INDEX_HEADER.unpack_from(mm, 0)
+    if magic != _INDEX_MAGIC:
+        mm.close()
+        raise ValueError(f'Not a valid index file: {index_path}')
+    return mm, count, table_offset, generation
+
+
+def _read_index_header(index_path):
+    with open(index_path, 'rb') as f:
+        magic, count, _, generation = _INDEX_HEADER.unpack(
+            f.read(_INDEX_HEADER.size))
+    if magic != _INDEX_MAGIC:
+        raise ValueError(f'Not a valid index file: {index_path}')
+    return count, generation
+
+
+def _iter_index(index_path):
+    mm, count, table_offset, _ = _open_index(index_path)
+    try:
+        for i in range(count):
+            offset, = _INDEX_OFFSET.unpack_from(
+                mm, table_offset + i * _INDEX_OFFSET.size)
+            yield _index_record_at(mm, offset)
+    finally:
+        mm.close()
+
+
+def _search_index(index_path, key):
+    # Return the record and the generation of the segment
+    mm, count, table_offset, generation = _open_index(index_path)
+    try:
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, = _INDEX_OFFSET.unpack_from(
+                mm, table_offset + mid * _INDEX_OFFSET.size)
+            record = _index_record_at(mm, offset)
+            if record[0] < key:
+                lo = mid + 1
+            elif record[0] > key:
+                hi = mid
+            else:
+                return record, generation
+        return None, generation
+    finally:
+        mm.close()
+
+
+def _write_index(index_path, records, generation):
+    # `records` must be sorted by name. For records with the same name, only
+    # the last one is written.
+    tmp_path = index_path + '.tmp'
+    offsets = array('Q')
+
+    def write_record(record):
+        name, folder_num, width, flags = record
+        offsets.append(f.tell())
+        f.write(_INDEX_RECORD.pack(folder_num, width, flags, len(name)))
+        f.write(name)
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            # Placeholder header, updated once the number of records is known
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, 0, 0, generation))
+            previous = None
+            for record in records:
+                if previous and previous[0] != record[0]:
+                    write_record(previous)
+                previous = record
+            if previous:
+                write_record(previous)
+            table_offset = f.tell()
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            offsets.tofile(f)
+            f.seek(0)
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(offsets),
+                                       table_offset, generation))
+        os.replace(tmp_path, index_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(offsets)
+
+
+def update_index(output_folder, entries):
+    """Add the entries to the lookup index found in the output folder.
+
+    `entries` is a list of tuples (file name, folder number, folder width,
+    has metadata) which gets sorted in place. The entries are written in a
+    new segment of the index, merged with the last segments only if these
+    aren't much bigger, so that adding a few files to a big index doesn't
+    rewrite it. A file name maps to only one folder: an old record with the
+    same name as a new entry is ignored, and among entries with the same
+    name the one with the highest folder number is kept.
+    """
+    segments = _get_index_segments(output_folder)
+    headers = [_read_index_header(path) for path in segments]
+    if not entries and segments:
+        return
+    # NOTE: names that aren't valid UTF-8 are decoded with surrogate escapes
+    # on POSIX, so the records are sorted by the encoded names. The folder
+    # number makes the order of entries with the same name independent of the
+    # order in which the moves finished.
+    entries.sort(key=lambda entry: (os.fsencode(entry[0]), entry[1]))
+    new_records = ((os.fsencode(name), folder_num, width,
+                    _INDEX_HAS_METADATA if has_metadata else 0)
+                   for name, folder_num, width, has_metadata in entries)
+    # Find the last segments to merge with the new one
+    level = len(segments)
+    number_records = len(entries)
+    if len(segments) >= _INDEX_MAX_SEGMENTS:
+        level = 0
+    while level and \
+            headers[level-1][0] <= _INDEX_MERGE_FACTOR * number_records:
+        level -= 1
+        number_records += headers[level][0]
+    # Records of older generations first: for records with the same name,
+    # merge() yields them in the order of its arguments and the last one is
+    # written
+    merged = sorted(range(level, len(segments)), key=lambda i: headers[i][1])
+    records = heapq.merge(*[_iter_index(segments[i]) for i in merged],
+                          new_records, key=itemgetter(0))
+    generation = max([generation for _, generation in headers], default=0) + 1
+    index_path = _get_index_path(output_folder, level)
+    logger.debug(f"Writing index segment: {index_path} (merged with "
+                 f"{len(merged)} segments)")
+    count = _write_index(index_path, records, generation)
+    # The merged segments are removed from the last one so that the remaining
+    # segments are always numbered consecutively. If this is interrupted, the
+    # remaining ones have an older generation than the new segment.
+    for path in reversed(segments[level+1:]):
+        os.remove(path)
+    logger.debug(f"Index segment contains {count} entries")
+
+
+def lookup(name, output_folder=os.getcwd(),
+           output_metadata_extension=OUTPUT_METADATA_EXTENSION, **kwargs):
+    """Find the folder holding the file `name` from the output folder's index.
+
+    The segments of the index are memory-mapped and binary-searched, so no
+    directory listing is needed. Returns a `SimpleNamespace` with the folder
+    number, the folder path and the metadata folder path (None if there is no
+    metadata file), or None if the file isn't in the index.
+    """
+    segments = _get_index_segments(output_folder)
+    if not segments:
+        msg = red("Index file doesn't exist: ")
+        logger.error(f'{msg} {_get_index_path(output_folder)}')
+        return None
+    key = os.fsencode(name)
+    record = None
+    latest_generation = -1
+    for path in segments:
+        found, generation = _search_index(path, key)
+        if found and generation > latest_generation:
+            record, latest_generation = found, generation
+    if record is None:
+        logger.warning(f'{name}: not found in the index')
+        return None
+    _, folder_num, width, flags = record
+    folder_basename = '{0:0{width}}'.format(folder_num, width=width)
+    folder = os.path.join(output_folder, folder_basename)
+    metadata_folder = None
+    if flags & _INDEX_HAS_METADATA:
+        metadata_folder = folder + '.' + output_metadata_extension
+    return SimpleNamespace(name=name, folder_number=folder_num, folder=folder,
+                           metadata_folder=metadata_folder)
+
+
 def split(folder_with_books,
           output_folder=os.getcwd(),
           dry_run=DRY_RUN,
@@ -198,22 +766,33 @@ def split(folder_with_books,
           output_metadata_extension=OUTPUT_METADATA_EXTENSION,
           reverse=REVERSE,
           start_number=START_NUMBER,
+          index=INDEX,
+          max_iops=MAX_IOPS,
+          max_bandwidth=MAX_BANDWIDTH,
+          jobs=JOBS,
+          adaptive=ADAPTIVE,
+          backend=None,
           **kwargs):
-    if not Path(output_folder).exists():
+    backend = backend or LocalFS()
+    if index and not isinstance(backend, LocalFS):
+        # The index is read and written directly on the local filesystem
+        msg = red("The index can only be written with the local filesystem")
+        logger.error(msg)
+        return 1
+    if not backend.exists(output_folder):
         msg = red("Output folder doesn't exist: ")
         logger.error(f'{msg} {output_folder}')
         return 1
-    if not Path(folder_with_books).exists():
+    if not backend.exists(folder_with_books):
         msg = red("Input folder doesn't exist: ")
         logger.error(f'{msg} {folder_with_books}')
         return 1
     files = []
-    for fp in Path(folder_with_books).rglob('*'):
+    for fp in backend.list_files(folder_with_books):
         # File extension
         ext = fp.suffix.split('.')[-1]
-        # Ignore directory, metadata and hidden files
-        if Path.is_file(fp) and ext != output_metadata_extension and \
-                not fp.name.startswith('.'):
+        # Ignore metadata and hidden files
+        if ext != output_metadata_extension and not fp.name.startswith('.'):
             # TODO: debug logging
             # print(fp)
             files.append(fp)
@@ -232,46 +811,105 @@ def split(folder_with_books,
     number_splits = math.ceil(total_files / files_per_folder)
     logger.info(f"Number of splits: {number_splits}")
     logger.info("Starting splits...")
-    while True:
-        if start_index >= len(files):
-            # TODO: debug logging
-            logger.info(f"End of splits!")
-            break
-        chunk = files[start_index:start_index+files_per_folder]
-        start_index += files_per_folder
-        logger.debug(f"Found {len(chunk)} files...")
-        current_folder_basename = '{0:0{width}}'.format(
-            current_folder_num, width=width)
-        current_folder = os.path.join(output_folder, current_folder_basename)
-        current_folder_metadata = os.path.join(
-            output_folder, current_folder_basename + '.' + output_metadata_extension)
-        current_folder_num += 1
+    scheduler = IOScheduler(max_iops, max_bandwidth, jobs, adaptive)
+    io = scheduler.call
+    # Device of the folders with files to move, to find the moves that copy
+    # data
+    devices = {}
+    if max_bandwidth:
+        output_device = io(backend.getdev, output_folder)
+
+    def get_nbytes(path):
+        # Moves within the same filesystem are renames: no data is copied
+        if not max_bandwidth:
+            return 0
+        if path.parent not in devices:
+            devices[path.parent] = io(backend.getdev, path.parent)
+        if devices[path.parent] == output_device:
+            return 0
+        return io(backend.getsize, path)
+
+    def move_files(files_to_move, folder_num, current_folder,
+                   current_folder_metadata):
+        # Files with the same name are moved one after the other by the same
+        # job since they have the same destination: otherwise two jobs could
+        # both find that the destination doesn't exist and the last one would
+        # overwrite the file moved by the other
+        for file_to_move in files_to_move:
+            move_file(file_to_move, folder_num, current_folder,
+                      current_folder_metadata)
+
+    def move_file(file_to_move, folder_num, current_folder,
+                  current_folder_metadata):
+        # TODO: important, explain that files skipped if already exist (not overwritten)
+        file_dest = os.path.join(current_folder, file_to_move.name)
         if dry_run:
-            logger.debug(f"Creating folder '{current_folder}'...")
+            logger.debug(f"Moving file '{file_to_move}'...")
         else:
-            mkdir(current_folder)
-        for file_to_move in chunk:
-            # TODO: important, explain that files skipped if already exist (not overwritten)
-            file_dest = os.path.join(current_folder, file_to_move.name)
+            io(backend.move, file_to_move, file_dest, clobber=False,
+               nbytes=get_nbytes(file_to_move))
+        # Move metadata file if found
+        # TODO: important, extension of metadata (other places too)
+        # metadata_name = f'{file_to_move.stem}.{output_metadata_extension}'
+        metadata_name = f'{file_to_move.name}.{output_metadata_extension}'
+        metada_file_to_move = file_to_move.parent.joinpath(metadata_name)
+        has_metadata = io(backend.exists, metada_file_to_move)
+        # The file is indexed as soon as it is moved so that the index is
+        # still complete if a later move fails
+        index_entries.append((file_to_move.name, folder_num, width,
+                              has_metadata))
+        if has_metadata:
+            logger.debug(f"Found metadata file: {metada_file_to_move}")
+            # Create metadata folder only if there is at least a
+            # metadata file
             if dry_run:
-                logger.debug(f"Moving file '{file_to_move}'...")
+                logger.debug(f"Creating folder '{current_folder_metadata}'...")
+                logger.debug(f"Moving file '{metadata_name}'...")
             else:
-                move(file_to_move, file_dest, clobber=False)
-            # Move metadata file if found
-            # TODO: important, extension of metadata (other places too)
-            # metadata_name = f'{file_to_move.stem}.{output_metadata_extension}'
-            metadata_name = f'{file_to_move.name}.{output_metadata_extension}'
-            metada_file_to_move = file_to_move.parent.joinpath(metadata_name)
-            if metada_file_to_move.exists():
-                logger.debug(f"Found metadata file: {metada_file_to_move}")
-                # Create metadata folder only if there is at least a
-                # metadata file
+                io(backend.mkdir, current_folder_metadata)
+                metadata_dest = os.path.join(current_folder_metadata,
+                                             metadata_name)
+                io(backend.move, metada_file_to_move, metadata_dest,
+                   clobber=False, nbytes=get_nbytes(metada_file_to_move))
+
+    # Entries of the lookup index: (file name, folder number, width, whether
+    # there is a metadata file)
+    index_entries = []
+    try:
+        with scheduler:
+            while True:
+                if start_index >= len(files):
+                    break
+                chunk = files[start_index:start_index+files_per_folder]
+                start_index += files_per_folder
+                logger.debug(f"Found {len(chunk)} files...")
+                current_folder_basename = '{0:0{width}}'.format(
+                    current_folder_num, width=width)
+                current_folder = os.path.join(output_folder, current_folder_basename)
+                current_folder_metadata = os.path.join(
+                    output_folder, current_folder_basename + '.' + output_metadata_extension)
+                folder_num = current_folder_num
+                current_folder_num += 1
                 if dry_run:
-                    logger.debug(f"Creating folder '{current_folder_metadata}'...")
-                    logger.debug(f"Moving file '{metadata_name}'...")
+                    logger.debug(f"Creating folder '{current_folder}'...")
                 else:
-                    mkdir(current_folder_metadata)
-                    metadata_dest = os.path.join(current_folder_metadata,
-                                                 metadata_name)
-                    move(metada_file_to_move, metadata_dest, clobber=False)
+                    io(backend.mkdir, current_folder)
+                # NOTE: the files are sorted by name
+                for _, files_to_move in groupby(chunk, key=lambda x: x.name):
+                    scheduler.submit(move_files, list(files_to_move), folder_num,
+                                     current_folder, current_folder_metadata)
+            # Wait for all the moves (and raise the first error if any)
+            scheduler.join()
+    finally:
+        # Index the files moved so far, even if the split failed
+        if index and not dry_run:
+            update_index(output_folder, index_entries)
+    # TODO: debug logging
+    logger.info(f"End of splits!")
+    logger.debug(f"Number of I/O operations: {scheduler.ops}")
+    if adaptive:
+        logger.debug(f"Number of in-flight operations: {scheduler.limit} "
+                     f"(min: {scheduler.min_limit}, max: {scheduler.max_limit})")
+    if index and dry_run:
+        logger.debug(f"Updating index '{_get_index_path(output_folder)}'...")
     return 0
@@ -10,11 +10,14 @@ Ref.: https://github.com/na--/ebook-tools
 import argparse
 import logging
 import os
+import sys
 
 from split_into_folders import __version__
-from split_into_folders.lib import (namespace_to_dict, setup_log, split, blue,
-                                    green, red, yellow, OUTPUT_METADATA_EXTENSION,
-                                    FILES_PER_FOLDER, FOLDER_PATTERN, START_NUMBER,
+from split_into_folders.lib import (lookup, namespace_to_dict, setup_log, split,
+                                    blue, green, red, yellow, ADAPTIVE_MAX_JOBS,
+                                    INDEX_FILENAME,
+                                    OUTPUT_METADATA_EXTENSION, FILES_PER_FOLDER,
+                                    FOLDER_PATTERN, START_NUMBER,
                                     LOGGING_FORMATTER, LOGGING_LEVEL)
 
 # import ipdb
@@ -207,6 +210,21 @@ def check_positive(value):
         return ivalue
 
 
+def check_size(value):
+    # e.g. 500, 100K, 20M, 1G (powers of 1024)
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3}
+    try:
+        multiplier = units.get(value[-1:].upper(), 1)
+        size = int(value[:-1] if multiplier > 1 else value) * multiplier
+        if size <= 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{value} is an invalid size (e.g. 500, 100K, 20M, 1G)")
+    else:
+        return size
+
+
 def get_default_message(default_value):
     return green(f' (default: {default_value})')
 
@@ -263,6 +281,36 @@ def setup_argparser():
         default=FILES_PER_FOLDER, type=check_positive,
         help='''How many files should be moved to each folder.'''
              + get_default_message(FILES_PER_FOLDER))
+    split_group.add_argument(
+        '-i', '--index', dest='index', action='store_true',
+        help=f'''Write (or update if it already exists) the lookup index
+            '{INDEX_FILENAME}' in the output folder. It maps each file name to
+            the folder holding it and can be queried with the `lookup`
+            command.''')
+    # ===========
+    # I/O options
+    # ===========
+    io_group = parser.add_argument_group(title=yellow('I/O options'))
+    io_group.add_argument(
+        '-j', '--jobs', dest='jobs', type=check_positive,
+        help=f'''Number of file operations (moves, stats, ...) that can be in
+            flight at the same time. If --adaptive is enabled, this is the
+            upper bound. (default: 1, or {ADAPTIVE_MAX_JOBS} with
+            --adaptive)''')
+    io_group.add_argument(
+        '--adaptive', dest='adaptive', action='store_true',
+        help='''Adjust the number of in-flight file operations based on
+            their observed latency: increase it while the storage keeps up and
+            halve it as soon as operations slow down (AIMD).''')
+    io_group.add_argument(
+        '--max-iops', dest='max_iops', metavar='IOPS', type=check_positive,
+        help='''Maximum number of file operations per second.''')
+    io_group.add_argument(
+        '--max-bandwidth', dest='max_bandwidth', metavar='SIZE',
+        type=check_size,
+        help='''Maximum number of bytes copied per second when moving files
+            to another filesystem, e.g. 500K or 20M. Moves within the same
+            filesystem are renames and aren't limited by it.''')
     # ====================
     # Input/Output options
     # ====================
@@ -288,6 +336,42 @@ def setup_argparser():
     return parser
 
 
+def setup_lookup_argparser():
+    width = os.get_terminal_size().columns - 5
+    usage_msg = blue('%(prog)s lookup [OPTIONS] {name}')
+    desc_msg = 'Find the folder holding the given file by searching the ' \
+               f'lookup index ({INDEX_FILENAME}) written by a previous split ' \
+               'with the --index option.'
+    parser = ArgumentParser(
+        prog=os.path.basename(sys.argv[0]),
+        description="",
+        usage=f"{usage_msg}\n\n{desc_msg}",
+        add_help=False,
+        formatter_class=lambda prog: MyFormatter(
+            prog, max_help_position=50, width=width))
+    add_general_options(
+        parser,
+        remove_opts=['dry-run', 'reverse'],
+        program_version=__version__,
+        title=yellow('General options'))
+    input_output_files_group = parser.add_argument_group(
+        title=yellow('Input and output options'))
+    input_output_files_group.add_argument(
+        '--ome', '--output-metadata-extension', dest='output_metadata_extension',
+        metavar='EXTENSION', default=OUTPUT_METADATA_EXTENSION,
+        help=''' This is the extension of the metadata file associated with
+        an ebook.''' + get_default_message(OUTPUT_METADATA_EXTENSION))
+    input_output_files_group.add_argument(
+        'name', help='''Name of the file to look up.''')
+    input_output_files_group.add_argument(
+        '-o', '--output-folder', dest='output_folder', metavar='PATH',
+        default=os.getcwd(),
+        help='''The output folder of the split, i.e. where the index is
+                located. The default value is the current working
+                directory.''' + get_default_message(os.getcwd()))
+    return parser
+
+
 def show_exit_code(exit_code):
     msg = f'Program exited with {exit_code}'
     if exit_code == 1:
@@ -299,14 +383,30 @@ def show_exit_code(exit_code):
 def main():
     global QUIET
     try:
-        parser = setup_argparser()
-        args = parser.parse_args()
+        # NOTE: `lookup` is checked before parsing so that the usual
+        # `split_into_folders {folder_with_books}` usage remains unchanged
+        if sys.argv[1:2] == ['lookup']:
+            parser = setup_lookup_argparser()
+            args = parser.parse_args(sys.argv[2:])
+        else:
+            parser = setup_argparser()
+            args = parser.parse_args()
         QUIET = args.quiet
         setup_log(args.quiet, args.verbose, args.logging_level, args.logging_formatter)
         # Actions
         error = False
         args_dict = namespace_to_dict(args)
-        exit_code = split(**args_dict)
+        if 'name' in args_dict:
+            result = lookup(**args_dict)
+            if result is None:
+                exit_code = 1
+            else:
+                print_(result.folder)
+                if result.metadata_folder:
+                    print_(result.metadata_folder)
+                exit_code = 0
+        else:
+            exit_code = split(**args_dict)
     except KeyboardInterrupt:
         print_(yellow('\nProgram stopped!'))
         exit_code = 2
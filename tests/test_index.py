@@ -0,0 +1,280 @@
+"""Tests of the lookup index written by `split()` in the output folder.
+
+Run them with::
+
+    $ python -m unittest discover tests
+"""
+import contextlib
+import io
+import os
+import struct
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from split_into_folders.lib import (_get_index_path, _get_index_segments,
+                                    _iter_index, _read_index_header,
+                                    _write_index, lookup, split, update_index)
+from split_into_folders.scripts import split_into_folders as script
+
+
+class IndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def get_folder_number(self, name):
+        result = lookup(name, self.tmpdir)
+        return None if result is None else result.folder_number
+
+
+class TestIndexFormat(IndexTestCase):
+
+    def test_layout(self):
+        update_index(self.tmpdir, [('b.pdf', 3, 8, True), ('a.pdf', 12, 4, False)])
+        data = Path(_get_index_path(self.tmpdir)).read_bytes()
+        magic, count, table_offset, generation = \
+            struct.unpack_from('<8sQQQ', data, 0)
+        self.assertEqual(magic, b'SPLTIDX2')
+        self.assertEqual(count, 2)
+        self.assertEqual(generation, 1)
+        self.assertEqual(len(data), table_offset + 8 * count)
+        offsets = struct.unpack_from('<2Q', data, table_offset)
+        records = []
+        for offset in offsets:
+            folder_num, width, flags, name_len = \
+                struct.unpack_from('<QBBH', data, offset)
+            start = offset + struct.calcsize('<QBBH')
+            records.append((data[start:start+name_len], folder_num, width,
+                            flags))
+        self.assertEqual(records, [(b'a.pdf', 12, 4, 0), (b'b.pdf', 3, 8, 1)])
+
+    def test_no_tmp_file_left(self):
+        update_index(self.tmpdir, [('a.pdf', 0, 8, False)])
+        self.assertEqual(os.listdir(self.tmpdir), ['.split_index'])
+
+    def test_tmp_file_removed_on_error(self):
+        def records():
+            yield b'a.pdf', 0, 8, 0
+            raise OSError('Write failed')
+
+        index_path = _get_index_path(self.tmpdir)
+        with self.assertRaises(OSError):
+            _write_index(index_path, records(), 1)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+class TestLookup(IndexTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.names = [f'book{i:04d}.pdf' for i in range(1000)]
+        update_index(self.tmpdir, [(name, i // 100, 8, i % 2 == 0)
+                                   for i, name in enumerate(self.names)])
+
+    def test_hit(self):
+        result = lookup('book0123.pdf', self.tmpdir)
+        self.assertEqual(result.folder_number, 1)
+        self.assertEqual(result.folder, os.path.join(self.tmpdir, '00000001'))
+
+    def test_first_and_last_entries(self):
+        self.assertEqual(self.get_folder_number('book0000.pdf'), 0)
+        self.assertEqual(self.get_folder_number('book0999.pdf'), 9)
+
+    def test_all_entries(self):
+        for i, name in enumerate(self.names):
+            self.assertEqual(self.get_folder_number(name), i // 100)
+
+    def test_miss(self):
+        for name in ['a.pdf', 'book0500', 'book0500.pdfx', 'z.pdf', '']:
+            with self.subTest(name=name):
+                self.assertIsNone(lookup(name, self.tmpdir))
+
+    def test_metadata_flag(self):
+        result = lookup('book0002.pdf', self.tmpdir)
+        self.assertEqual(result.metadata_folder,
+                         os.path.join(self.tmpdir, '00000000.meta'))
+        result = lookup('book0002.pdf', self.tmpdir,
+                        output_metadata_extension='opf')
+        self.assertTrue(result.metadata_folder.endswith('00000000.opf'))
+        self.assertIsNone(lookup('book0003.pdf', self.tmpdir).metadata_folder)
+
+    def test_no_index(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertIsNone(lookup('book0000.pdf', tmpdir))
+
+
+class TestEmptyIndex(IndexTestCase):
+
+    def test_lookup(self):
+        update_index(self.tmpdir, [])
+        self.assertEqual(_read_index_header(_get_index_path(self.tmpdir)),
+                         (0, 1))
+        self.assertIsNone(lookup('a.pdf', self.tmpdir))
+
+
+class TestNames(IndexTestCase):
+
+    def test_non_ascii_names(self):
+        names = ['été.pdf', 'ete.pdf', 'Éte.pdf', '書籍.epub', 'z.pdf']
+        update_index(self.tmpdir, [(name, i, 8, False)
+                                   for i, name in enumerate(names)])
+        for i, name in enumerate(names):
+            self.assertEqual(self.get_folder_number(name), i)
+        keys = [record[0] for record in
+                _iter_index(_get_index_path(self.tmpdir))]
+        self.assertEqual(keys, sorted(keys))
+
+    @unittest.skipIf(sys.platform in ['win32', 'darwin'],
+                     'Requires file names that are not valid UTF-8')
+    def test_undecodable_names(self):
+        input_folder = os.path.join(self.tmpdir, 'books')
+        output_folder = os.path.join(self.tmpdir, 'output')
+        os.mkdir(input_folder)
+        os.mkdir(output_folder)
+        for name in [b'bad\xff.pdf', b'good.pdf', b'\xc3\xa9t\xc3\xa9.pdf']:
+            with open(os.path.join(os.fsencode(input_folder), name), 'wb'):
+                pass
+        self.assertEqual(split(input_folder, output_folder, index=True), 0)
+        result = lookup(os.fsdecode(b'bad\xff.pdf'), output_folder)
+        self.assertEqual(result.folder_number, 0)
+        self.assertEqual(lookup('été.pdf', output_folder).folder_number, 0)
+        keys = [record[0] for record in
+                _iter_index(_get_index_path(output_folder))]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual(sorted(os.listdir(output_folder)),
+                         ['.split_index', '00000000'])
+
+
+class TestUpdate(IndexTestCase):
+
+    def test_new_record_replaces_old_one(self):
+        update_index(self.tmpdir, [('a.pdf', 1, 8, True), ('b.pdf', 1, 8, False)])
+        update_index(self.tmpdir, [('a.pdf', 7, 8, False)])
+        result = lookup('a.pdf', self.tmpdir)
+        self.assertEqual(result.folder_number, 7)
+        self.assertIsNone(result.metadata_folder)
+        self.assertEqual(self.get_folder_number('b.pdf'), 1)
+
+    def test_duplicate_names_in_one_update(self):
+        # The order of the entries depends on which moves finished first
+        update_index(self.tmpdir, [('a.pdf', 5, 8, False), ('a.pdf', 2, 8, False)])
+        self.assertEqual(self.get_folder_number('a.pdf'), 5)
+
+    def test_small_update_adds_a_segment(self):
+        update_index(self.tmpdir, [(f'{i:04d}.pdf', 0, 8, False)
+                                   for i in range(100)])
+        update_index(self.tmpdir, [('new.pdf', 1, 8, False)])
+        segments = _get_index_segments(self.tmpdir)
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(_read_index_header(segments[0]), (100, 1))
+        self.assertEqual(_read_index_header(segments[1]), (1, 2))
+        self.assertEqual(self.get_folder_number('new.pdf'), 1)
+        self.assertEqual(self.get_folder_number('0042.pdf'), 0)
+
+    def test_segments_are_merged(self):
+        update_index(self.tmpdir, [(f'{i:04d}.pdf', 0, 8, False)
+                                   for i in range(100)])
+        for i in range(60):
+            update_index(self.tmpdir, [(f'new{i:02d}.pdf', i + 1, 8, False),
+                                       ('0000.pdf', i + 1, 8, False)])
+        segments = _get_index_segments(self.tmpdir)
+        self.assertLess(len(segments), 8)
+        number_records = sum(_read_index_header(path)[0] for path in segments)
+        # Records shadowed by newer ones may remain in unmerged segments
+        self.assertGreaterEqual(number_records, 160)
+        self.assertEqual(self.get_folder_number('0000.pdf'), 60)
+        self.assertEqual(self.get_folder_number('0099.pdf'), 0)
+        for i in range(60):
+            self.assertEqual(self.get_folder_number(f'new{i:02d}.pdf'), i + 1)
+
+    def test_large_update_merges_everything(self):
+        update_index(self.tmpdir, [('a.pdf', 0, 8, False)])
+        update_index(self.tmpdir, [(f'{i:04d}.pdf', 1, 8, False)
+                                   for i in range(10)])
+        segments = _get_index_segments(self.tmpdir)
+        self.assertEqual(len(segments), 1)
+        self.assertEqual(_read_index_header(segments[0]), (11, 2))
+
+    def test_newest_generation_wins(self):
+        # e.g. interrupted after writing a merged segment but before removing
+        # the segments that were merged into it
+        _write_index(_get_index_path(self.tmpdir, 0),
+                     [(b'a.pdf', 5, 8, 0)], 3)
+        _write_index(_get_index_path(self.tmpdir, 1),
+                     [(b'a.pdf', 1, 8, 0), (b'b.pdf', 1, 8, 0)], 2)
+        self.assertEqual(self.get_folder_number('a.pdf'), 5)
+        self.assertEqual(self.get_folder_number('b.pdf'), 1)
+
+
+class TestSplitWithIndex(IndexTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.input_folder = os.path.join(self.tmpdir, 'books')
+        self.output_folder = os.path.join(self.tmpdir, 'output')
+        os.mkdir(self.input_folder)
+        os.mkdir(self.output_folder)
+
+    def add_books(self, names):
+        for name in names:
+            Path(self.input_folder, name).touch()
+
+    def test_append_run(self):
+        self.add_books([f'book{i:03d}.pdf' for i in range(25)])
+        Path(self.input_folder, 'book007.pdf.meta').touch()
+        split(self.input_folder, self.output_folder, files_per_folder=10,
+              index=True)
+        self.add_books(['book100.pdf', 'book101.pdf'])
+        split(self.input_folder, self.output_folder, files_per_folder=10,
+              start_number=3, index=True)
+        result = lookup('book007.pdf', self.output_folder)
+        self.assertEqual(result.folder_number, 0)
+        self.assertTrue(os.path.exists(os.path.join(result.folder, 'book007.pdf')))
+        self.assertTrue(os.path.exists(os.path.join(result.metadata_folder,
+                                                    'book007.pdf.meta')))
+        self.assertEqual(lookup('book024.pdf', self.output_folder).folder_number, 2)
+        self.assertEqual(lookup('book101.pdf', self.output_folder).folder_number, 3)
+        self.assertIsNone(lookup('book007.pdf.meta', self.output_folder))
+
+    def test_dry_run(self):
+        self.add_books(['a.pdf'])
+        split(self.input_folder, self.output_folder, dry_run=True, index=True)
+        self.assertEqual(_get_index_segments(self.output_folder), [])
+
+
+class TestLookupScript(IndexTestCase):
+
+    def run_script(self, *args):
+        stdout = io.StringIO()
+        argv = ['split_into_folders', 'lookup', *args, '-o', self.tmpdir]
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch('os.get_terminal_size',
+                           return_value=os.terminal_size((120, 40))), \
+                contextlib.redirect_stdout(stdout), \
+                contextlib.redirect_stderr(io.StringIO()):
+            exit_code = script.main()
+        return exit_code, stdout.getvalue().splitlines()
+
+    def test_found(self):
+        update_index(self.tmpdir, [('a.pdf', 4, 8, True)])
+        exit_code, lines = self.run_script('a.pdf')
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(lines, [os.path.join(self.tmpdir, '00000004'),
+                                 os.path.join(self.tmpdir, '00000004.meta')])
+
+    def test_not_found(self):
+        update_index(self.tmpdir, [('a.pdf', 4, 8, False)])
+        exit_code, lines = self.run_script('b.pdf')
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(lines, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+"""Tests of the I/O scheduler, run against the in-memory `FakeFS` backend.
+
+Run them with::
+
+    $ python -m unittest discover tests
+"""
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from split_into_folders.lib import FakeFS, IOScheduler, TokenBucket, split
+
+
+def create_fake_fs(number_files, **kwargs):
+    files = {f'/books/book{i:04d}.pdf': 1000 for i in range(number_files)}
+    backend = FakeFS(files, **kwargs)
+    backend.mkdir('/output')
+    return backend
+
+
+def get_moved_files(backend):
+    return [path for path in backend._files if path.startswith('/output')]
+
+
+class FakeClock:
+    """Clock that only moves forward when sleeping, to test without waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    def advance(self, seconds):
+        # Time spent without sleeping, e.g. in a file operation
+        with self._lock:
+            self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_rate(self):
+        bucket = TokenBucket(rate=100, capacity=1, clock=self.clock.time,
+                             sleep=self.clock.sleep)
+        for _ in range(51):
+            bucket.acquire()
+        # The first token is available right away, the 50 others take 10 ms
+        # each
+        self.assertEqual(len(self.clock.sleeps), 50)
+        self.assertAlmostEqual(self.clock.now, 0.5)
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=100, clock=self.clock.time,
+                             sleep=self.clock.sleep)
+        for _ in range(100):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=100, capacity=10, clock=self.clock.time,
+                             sleep=self.clock.sleep)
+        for _ in range(10):
+            bucket.acquire()
+        # Tokens refilled while idle, but never more than the capacity
+        self.clock.now += 60
+        for _ in range(10):
+            bucket.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+        bucket.acquire()
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(self.clock.sleeps[0], 0.01)
+
+    def test_request_larger_than_capacity(self):
+        bucket = TokenBucket(rate=1000, capacity=100, clock=self.clock.time,
+                             sleep=self.clock.sleep)
+        bucket.acquire(100)
+        bucket.acquire(300)
+        self.assertEqual(len(self.clock.sleeps), 1)
+        self.assertAlmostEqual(self.clock.now, 0.3)
+
+
+class TestIOScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_max_iops(self):
+        backend = create_fake_fs(150, latency=0.001, jitter=0.001, seed=0,
+                                 sleep=self.clock.advance)
+        ops = backend.ops
+        scheduler = IOScheduler(max_iops=100, clock=self.clock.time,
+                                sleep=self.clock.sleep)
+        with scheduler:
+            for path in list(backend._files):
+                scheduler.call(backend.exists, path)
+        self.assertEqual(scheduler.ops, 150)
+        self.assertEqual(backend.ops - ops, 150)
+        # One second of burst (100 operations), then 100 operations per
+        # second: the last operations are delayed until 0.5 s (plus the
+        # latency of the operations, at most 2 ms each)
+        self.assertGreater(len(self.clock.sleeps), 0)
+        self.assertGreaterEqual(self.clock.now, 0.5)
+        self.assertLessEqual(self.clock.now, 0.51)
+
+    def test_max_bandwidth(self):
+        scheduler = IOScheduler(max_bandwidth=50000, clock=self.clock.time,
+                                sleep=self.clock.sleep)
+        for _ in range(100):
+            scheduler.call(lambda: None, nbytes=1000)
+        # 100 KB: one second of burst (50 KB), then 50 KB per second
+        self.assertEqual(len(self.clock.sleeps), 50)
+        self.assertAlmostEqual(self.clock.now, 1)
+
+    def test_max_bandwidth_only_counts_copies(self):
+        for devices, expected in [({}, 0), ({'/output': 1}, 100 * 1000)]:
+            with self.subTest(devices=devices):
+                backend = create_fake_fs(100, devices=devices)
+                with mock.patch.object(TokenBucket, 'acquire',
+                                       autospec=True) as acquire:
+                    split('/books', '/output', backend=backend,
+                          max_bandwidth=1000)
+                nbytes = sum(call.args[1] for call in acquire.call_args_list)
+                self.assertEqual(nbytes, expected)
+                self.assertEqual(len(get_moved_files(backend)), 100)
+
+    def run_adaptive(self, scheduler, latency, number_ops=3000):
+        # `latency(limit)` is the latency of an operation when `limit`
+        # operations are allowed in flight
+        def exists():
+            self.clock.now += latency(scheduler.limit)
+
+        limits = []
+        for _ in range(number_ops):
+            scheduler.call(exists)
+            limits.append(scheduler.limit)
+        return limits
+
+    def test_adaptive_limit(self):
+        # The latency grows once more than 8 operations are in flight
+        scheduler = IOScheduler(jobs=64, adaptive=True, clock=self.clock.time)
+        self.assertEqual(scheduler.limit, 1)
+        limits = self.run_adaptive(
+            scheduler, lambda limit: 0.005 * max(1, limit / 8))
+        # Additive increase up to the capacity, then the limit is halved as
+        # soon as the latency goes up and it oscillates around the capacity
+        self.assertGreater(scheduler.max_limit, 8)
+        self.assertLess(scheduler.max_limit, 24)
+        for limit in limits[-1000:]:
+            self.assertGreaterEqual(limit, 4)
+            self.assertLessEqual(limit, scheduler.max_limit)
+
+    def test_adaptive_limit_without_saturation(self):
+        scheduler = IOScheduler(jobs=16, adaptive=True, clock=self.clock.time)
+        limits = self.run_adaptive(scheduler, lambda limit: 0.005)
+        self.assertEqual(limits[-1], 16)
+        self.assertEqual(scheduler.min_limit, 1)
+        # One more operation in flight after each window of fast operations
+        self.assertEqual(limits.index(2), 0)
+        self.assertEqual(limits.index(3), 2)
+
+    def test_error_stops_split(self):
+        for jobs in [1, 8]:
+            with self.subTest(jobs=jobs):
+                backend = create_fake_fs(200)
+                move = backend.move
+
+                def failing_move(src, dst, clobber=True):
+                    if Path(src).name == 'book0005.pdf':
+                        raise OSError('Move failed')
+                    move(src, dst, clobber)
+
+                backend.move = failing_move
+                with self.assertRaises(OSError):
+                    split('/books', '/output', backend=backend, jobs=jobs)
+                # Only the jobs already queued are run
+                self.assertLess(len(get_moved_files(backend)), 5 + 4 * jobs)
+
+    def test_index_rejected_with_fake_fs(self):
+        backend = create_fake_fs(10)
+        ops = backend.ops
+        retcode = split('/books', '/output', backend=backend, index=True)
+        self.assertEqual(retcode, 1)
+        self.assertEqual(backend.ops, ops)
+
+    def test_same_name_not_overwritten(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_folder = os.path.join(tmpdir, 'books')
+            output_folder = os.path.join(tmpdir, 'output')
+            os.mkdir(output_folder)
+            for subfolder in ['a', 'b']:
+                os.makedirs(os.path.join(input_folder, subfolder))
+                for i in range(200):
+                    path = os.path.join(input_folder, subfolder, f'book{i}.pdf')
+                    Path(path).touch()
+            split(input_folder, output_folder, files_per_folder=50, jobs=8)
+            number_files = sum(len(files) for _, _, files in os.walk(tmpdir))
+            self.assertEqual(number_files, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()